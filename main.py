@@ -1,10 +1,29 @@
+import argparse
+import asyncio
+import html
+import importlib.util
+import io
+import json
 import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import random
+import re
+import signal
+import socket
 import sqlite3
-from datetime import datetime, time
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime, time, timedelta
 import pytz
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import (Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, InputMediaVideo,
+                      InputMediaDocument, InputMediaAudio, Message, MessageEntity)
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 from telegram.constants import ParseMode
+from telegram.error import TelegramError, RetryAfter, NetworkError, BadRequest, Forbidden, ChatMigrated
 
 # Enable logging
 logging.basicConfig(
@@ -13,6 +32,54 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+ADMIN_CHAT_ID = -4796230051
+
+# Delivery settings for forwarding user messages to the admin chat
+SEND_MAX_ATTEMPTS = 4          # attempts per send before giving up and queueing
+SEND_BASE_BACKOFF = 0.5        # seconds, doubled on every retry
+SEND_MAX_BACKOFF = 2.0         # cap for the exponential backoff
+SEND_RETRY_BUDGET = 3          # seconds a handler may spend retrying network errors, the queue does the rest
+SEND_MAX_RETRY_AFTER = 10      # flood waits broadcasts sleep through, forwards open the circuit instead
+CIRCUIT_FAILURE_THRESHOLD = 5  # consecutive failed forwards before the circuit opens
+CIRCUIT_COOLDOWN = 60          # seconds the circuit stays open before a trial send
+PENDING_FLUSH_INTERVAL = 5     # seconds between attempts to drain the forward queue
+PENDING_FLUSH_BATCH = 20       # queued forwards delivered per flush
+
+# Multi-worker settings
+LEADER_LEASE_TTL = 15          # seconds a leader lease is valid without renewal
+LEADER_RENEW_INTERVAL = 5      # seconds between lease renewals
+LEADER_POLL_TIMEOUT = 2        # long-poll timeout used by the leader, kept below the renew interval
+WORKER_IDLE_SLEEP = 0.2        # seconds a worker waits when its shard has no updates
+WORKER_BATCH = 50              # updates a worker takes from its shard at once
+WORKER_RESTART_DELAY = 5       # seconds before a worker that exited is started again
+RESET_CHECK_INTERVAL = 60      # seconds between daily reset checks by the leader
+BROADCAST_OUTBOX_INTERVAL = 60 # seconds between checks for interrupted broadcasts
+SHUTDOWN_DRAIN_DEADLINE = 20   # seconds in-flight sends may take after a shutdown is requested
+
+# Diagnostics commands
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+PROFILE_TOP_FUNCTIONS = 30
+MEMORY_TRACE_FRAMES = 1          # frames stored per allocation while /memdiff is tracing
+MEMORY_TOP_STATS = 30
+LOOP_LAG_SAMPLES = 20
+LOOP_LAG_INTERVAL = 0.05
+
+# What this process is doing. In single-process mode it's always the leader.
+worker_state = {
+    'worker_id': None,
+    'num_workers': 1,
+    'name': f"{socket.gethostname()}:{os.getpid()}",
+    'leader': True
+}
+
+# Set once a shutdown has been requested
+shutdown_state = {
+    'stopping': False,
+    'deadline': None
+}
+
 
 def init_db():
     conn = sqlite3.connect('user_rooms.db')
@@ -40,9 +107,56 @@ def init_db():
         timestamp TEXT
     )
     ''')
+    # Forward header rendered once per user, see render_forward_header
+    cursor.execute('PRAGMA table_info(user_rooms)')
+    if 'header' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE user_rooms ADD COLUMN header TEXT')
+    # Durable queue for forwards that could not be delivered to the admin chat
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS pending_forwards (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        payload TEXT,
+        attempts INTEGER DEFAULT 0,
+        created_at TEXT
+    )
+    ''')
+    # State shared between workers (pending broadcast, update offset, ...)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS shared_state (
+        name TEXT PRIMARY KEY,
+        value TEXT
+    )
+    ''')
+    # Updates fetched by the leader, waiting for the worker that owns their shard
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS update_queue (
+        update_id INTEGER PRIMARY KEY,
+        shard INTEGER,
+        payload TEXT
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_update_queue_shard ON update_queue (shard, update_id)')
+    # Broadcast recipients not reached before a shutdown
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS broadcast_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        message TEXT
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS leader_lease (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        holder TEXT,
+        expires_at REAL
+    )
+    ''')
     # Initialize bot_state if it doesn't exist
     cursor.execute('INSERT OR IGNORE INTO bot_state (id, last_reset_date) VALUES (1, NULL)')
+    cursor.execute('INSERT OR IGNORE INTO leader_lease (id, holder, expires_at) VALUES (1, NULL, 0)')
     conn.commit()
+    # Let several worker processes read while one writes
+    cursor.execute('PRAGMA journal_mode=WAL')
     conn.close()
 
 # Initialize database
@@ -83,6 +197,244 @@ def get_forwarded_message(admin_msg_id):
     return None
 
 
+def enqueue_forward(forward):
+    """Store a forward that could not be delivered so it can be retried later"""
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('''
+    INSERT INTO pending_forwards (payload, attempts, created_at)
+    VALUES (?, 0, ?)
+    ''', (json.dumps(forward), datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+    logger.warning(f"Queued forward from user_chat_id={forward['user_chat_id']} for later delivery")
+
+
+def get_pending_forwards(limit):
+    """Retrieve the oldest queued forwards"""
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT id, payload, attempts FROM pending_forwards
+    ORDER BY id LIMIT ?
+    ''', (limit,))
+    rows = cursor.fetchall()
+    conn.close()
+
+    return [
+        {'id': row[0], 'forward': json.loads(row[1]), 'attempts': row[2]}
+        for row in rows
+    ]
+
+
+def has_pending_forwards():
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('SELECT 1 FROM pending_forwards LIMIT 1')
+    result = cursor.fetchone()
+    conn.close()
+    return result is not None
+
+
+def delete_pending_forward(pending_id):
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM pending_forwards WHERE id = ?', (pending_id,))
+    conn.commit()
+    conn.close()
+
+
+def mark_pending_forward_failed(pending_id):
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('UPDATE pending_forwards SET attempts = attempts + 1 WHERE id = ?', (pending_id,))
+    conn.commit()
+    conn.close()
+
+
+def get_shared_state(name, default=None):
+    """Read a JSON value shared between all workers"""
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('SELECT value FROM shared_state WHERE name = ?', (name,))
+    result = cursor.fetchone()
+    conn.close()
+
+    if result:
+        return json.loads(result[0])
+    return default
+
+
+def set_shared_state(name, value):
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('INSERT OR REPLACE INTO shared_state (name, value) VALUES (?, ?)', (name, json.dumps(value)))
+    conn.commit()
+    conn.close()
+
+
+def take_shared_state(name):
+    """Read and remove a shared value in one step, so only one reader ever gets it"""
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    cursor.execute('SELECT value FROM shared_state WHERE name = ?', (name,))
+    result = cursor.fetchone()
+    cursor.execute('DELETE FROM shared_state WHERE name = ?', (name,))
+    conn.commit()
+    conn.close()
+
+    if result:
+        return json.loads(result[0])
+    return None
+
+
+def get_pending_broadcast():
+    return get_shared_state('pending_broadcast', {})
+
+
+def save_pending_broadcast(pending):
+    set_shared_state('pending_broadcast', pending)
+
+
+def clear_pending_broadcast():
+    set_shared_state('pending_broadcast', {})
+
+
+def enqueue_updates(holder, rows, next_offset):
+    """Store fetched updates and the next getUpdates offset in one transaction.
+
+    Nothing is written unless holder still holds an unexpired leader lease, so a leader that
+    stalled past its lease can't re-queue updates a newer leader already handled.
+    Returns True if the updates were stored.
+    """
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    # Take the write lock first so the lease can't change between the check and the insert
+    cursor.execute('BEGIN IMMEDIATE')
+    cursor.execute('SELECT 1 FROM leader_lease WHERE id = 1 AND holder = ? AND expires_at >= ?',
+                   (holder, datetime.now().timestamp()))
+    if cursor.fetchone() is None:
+        conn.rollback()
+        conn.close()
+        return False
+    cursor.executemany('INSERT OR IGNORE INTO update_queue (update_id, shard, payload) VALUES (?, ?, ?)', rows)
+    cursor.execute('INSERT OR REPLACE INTO shared_state (name, value) VALUES (?, ?)',
+                   ('update_offset', json.dumps(next_offset)))
+    conn.commit()
+    conn.close()
+    return True
+
+
+def get_queued_updates(shard, limit):
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT update_id, payload FROM update_queue
+    WHERE shard = ? ORDER BY update_id LIMIT ?
+    ''', (shard, limit))
+    rows = cursor.fetchall()
+    conn.close()
+
+    return [(row[0], json.loads(row[1])) for row in rows]
+
+
+def delete_queued_update(update_id):
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM update_queue WHERE update_id = ?', (update_id,))
+    conn.commit()
+    conn.close()
+
+
+def try_acquire_leadership(holder):
+    """Take or renew the leader lease. Only one worker can hold it at a time."""
+    now = datetime.now().timestamp()
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('''
+    UPDATE leader_lease SET holder = ?, expires_at = ?
+    WHERE id = 1 AND (holder = ? OR holder IS NULL OR expires_at < ?)
+    ''', (holder, now + LEADER_LEASE_TTL, holder, now))
+    acquired = cursor.rowcount == 1
+    conn.commit()
+    conn.close()
+    return acquired
+
+
+def release_leadership(holder):
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('UPDATE leader_lease SET holder = NULL, expires_at = 0 WHERE id = 1 AND holder = ?', (holder,))
+    conn.commit()
+    conn.close()
+
+
+def checkpoint_broadcast(entries):
+    """Save the (user_id, bundle) entries a broadcast didn't get to, so they can be sent later"""
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.executemany('INSERT INTO broadcast_outbox (user_id, message) VALUES (?, ?)',
+                       [(user_id, json.dumps(bundle)) for user_id, bundle in entries])
+    conn.commit()
+    conn.close()
+    logger.warning(f"Checkpointed broadcast for {len(entries)} remaining users")
+
+
+def has_broadcast_outbox():
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('SELECT 1 FROM broadcast_outbox LIMIT 1')
+    found = cursor.fetchone() is not None
+    conn.close()
+    return found
+
+
+def get_broadcast_outbox():
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, user_id, message FROM broadcast_outbox ORDER BY id')
+    rows = cursor.fetchall()
+    conn.close()
+
+    return [{'id': row[0], 'user_id': row[1], 'bundle': json.loads(row[2])} for row in rows]
+
+
+def update_broadcast_outbox_entry(entry_id, bundle):
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('UPDATE broadcast_outbox SET message = ? WHERE id = ?', (json.dumps(bundle), entry_id))
+    conn.commit()
+    conn.close()
+
+
+def delete_broadcast_outbox_entry(entry_id):
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM broadcast_outbox WHERE id = ?', (entry_id,))
+    conn.commit()
+    conn.close()
+
+
+def get_pending_work_counts():
+    """Count the work left in the database for the next start"""
+    conn = sqlite3.connect('user_rooms.db')
+    cursor = conn.cursor()
+    counts = {}
+    for table in ('pending_forwards', 'broadcast_outbox', 'update_queue'):
+        cursor.execute(f'SELECT COUNT(*) FROM {table}')
+        counts[table] = cursor.fetchone()[0]
+    conn.close()
+    return counts
+
+
+def checkpoint_database():
+    """Move everything in the write-ahead log into the database file"""
+    conn = sqlite3.connect('user_rooms.db')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+
+
 # Function to check if reset is needed
 def check_and_reset_if_needed():
     conn = sqlite3.connect('user_rooms.db')
@@ -96,20 +448,20 @@ def check_and_reset_if_needed():
     # Check if it's past 9am
     is_past_9am = now.time() >= time(9, 0)
 
-    # Get the last reset date
-    cursor.execute('SELECT last_reset_date FROM bot_state WHERE id = 1')
-    last_reset_date = cursor.fetchone()[0]
-
-    # Check if reset is needed
-    if is_past_9am and (not last_reset_date or last_reset_date != current_date):
-        # Reset all user selections
-        cursor.execute('UPDATE user_rooms SET last_selection_date = NULL')
+    # Check if reset is needed. The conditional update claims today's reset,
+    # so when several workers race only one of them clears the selections.
+    if is_past_9am:
+        cursor.execute('''
+        UPDATE bot_state SET last_reset_date = ?
+        WHERE id = 1 AND (last_reset_date IS NULL OR last_reset_date != ?)
+        ''', (current_date, current_date))
 
-        # Update last reset date
-        cursor.execute('UPDATE bot_state SET last_reset_date = ?', (current_date,))
+        if cursor.rowcount == 1:
+            # Reset all user selections
+            cursor.execute('UPDATE user_rooms SET last_selection_date = NULL')
+            logger.info(f"All room selections have been reset on {current_date}")
 
         conn.commit()
-        logger.info(f"All room selections have been reset on {current_date}")
 
     conn.close()
 
@@ -132,17 +484,31 @@ def has_selected_today(user_id):
     return False
 
 
-# Function to get user's current room and username
+def render_forward_header(user_id, username, room):
+    """Render the header shown above forwarded messages, escaped for ParseMode.HTML"""
+    username = html.escape(username or f"user_{user_id}", quote=False)
+    room = html.escape(room or "Unknown Room", quote=False)
+    return f"<b>Message from {username}</b> | <b>Room: {room}</b>\n\n"
+
+
+# Function to get user's current room, username and forward header
 def get_user_info(user_id):
     conn = sqlite3.connect('user_rooms.db')
     cursor = conn.cursor()
 
-    cursor.execute('SELECT selected_room, username FROM user_rooms WHERE user_id = ?', (user_id,))
+    cursor.execute('SELECT selected_room, username, header FROM user_rooms WHERE user_id = ?', (user_id,))
     result = cursor.fetchone()
+
+    if result and result[2] is None:
+        # Rows saved before headers were cached get theirs on first use
+        header = render_forward_header(user_id, result[1], result[0])
+        cursor.execute('UPDATE user_rooms SET header = ? WHERE user_id = ?', (header, user_id))
+        conn.commit()
+        result = (result[0], result[1], header)
     conn.close()
 
     if result:
-        return {"room": result[0], "username": result[1]}
+        return {"room": result[0], "username": result[1], "header": result[2]}
     return None
 
 
@@ -180,10 +546,13 @@ def update_user_room(user_id, room, username):
     israel_tz = pytz.timezone('Asia/Jerusalem')
     current_date = datetime.now(israel_tz).date().isoformat()
 
+    # The header only changes with the username or room, so render it here rather than per message
+    header = render_forward_header(user_id, username, room)
+
     cursor.execute('''
-    INSERT OR REPLACE INTO user_rooms (user_id, username, selected_room, last_selection_date)
-    VALUES (?, ?, ?, ?)
-    ''', (user_id, username, room, current_date))
+    INSERT OR REPLACE INTO user_rooms (user_id, username, selected_room, last_selection_date, header)
+    VALUES (?, ?, ?, ?, ?)
+    ''', (user_id, username, room, current_date, header))
 
     conn.commit()
     conn.close()
@@ -247,6 +616,274 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+# Circuit breaker state for the admin chat
+admin_circuit = {
+    'failures': 0,
+    'open_until': None
+}
+
+
+def admin_circuit_is_open():
+    """Check whether forwards to the admin chat should skip straight to the queue"""
+    open_until = admin_circuit['open_until']
+    # Once the time is up let a trial send through (half-open)
+    return open_until is not None and datetime.now() < open_until
+
+
+def open_admin_circuit(seconds):
+    open_until = datetime.now() + timedelta(seconds=seconds)
+    if admin_circuit['open_until'] is None or admin_circuit['open_until'] < open_until:
+        logger.error(f"Opening circuit for the admin chat for {seconds:.0f}s")
+        admin_circuit['open_until'] = open_until
+
+
+def record_admin_success():
+    if admin_circuit['open_until'] is not None:
+        logger.info("Admin chat is reachable again, closing circuit")
+    admin_circuit['failures'] = 0
+    admin_circuit['open_until'] = None
+
+
+def record_admin_failure(error):
+    if isinstance(error, RetryAfter):
+        # Telegram told us exactly how long to stay away
+        open_admin_circuit(get_retry_after_seconds(error))
+        return
+    if is_admin_chat_gone(error):
+        # Retrying right away can't help, someone has to fix the admin chat first
+        logger.error(f"Admin chat {ADMIN_CHAT_ID} is unusable, forwards are queued until it is fixed: {error}")
+        open_admin_circuit(CIRCUIT_COOLDOWN)
+        return
+
+    admin_circuit['failures'] += 1
+    if admin_circuit['failures'] >= CIRCUIT_FAILURE_THRESHOLD:
+        logger.error(f"Admin chat failed {admin_circuit['failures']} times in a row")
+        open_admin_circuit(CIRCUIT_COOLDOWN)
+
+
+def is_transient_error(error):
+    """Flood control and network problems are worth retrying, bad requests are not"""
+    if isinstance(error, RetryAfter):
+        return True
+    return isinstance(error, NetworkError) and not isinstance(error, BadRequest)
+
+
+def is_admin_chat_gone(error):
+    """The bot was removed from the admin chat or the chat was upgraded to a supergroup"""
+    return isinstance(error, (Forbidden, ChatMigrated))
+
+
+def should_queue_forward(error):
+    """Forwards that failed for these reasons can still be delivered later"""
+    return is_transient_error(error) or is_admin_chat_gone(error)
+
+
+def get_retry_after_seconds(error):
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+async def send_with_retry(send_func, flood_wait_limit=0, **kwargs):
+    """Call a bot send method, retrying network errors with capped exponential backoff and jitter.
+
+    Flood waits (RetryAfter) are only slept through when they are at most flood_wait_limit
+    seconds, otherwise they are raised right away. Retries stop once SEND_RETRY_BUDGET is used up,
+    since updates are handled one at a time and a long wait here stalls every chat.
+    """
+    loop = asyncio.get_running_loop()
+    retry_until = loop.time() + SEND_RETRY_BUDGET
+    for attempt in range(1, SEND_MAX_ATTEMPTS + 1):
+        try:
+            return await send_func(**kwargs)
+        except TelegramError as e:
+            if not is_transient_error(e) or attempt == SEND_MAX_ATTEMPTS:
+                raise
+
+            if isinstance(e, RetryAfter):
+                delay = get_retry_after_seconds(e)
+                if delay > flood_wait_limit:
+                    raise
+            else:
+                # Full jitter spreads out retries from concurrent senders
+                delay = random.uniform(0, min(SEND_MAX_BACKOFF, SEND_BASE_BACKOFF * 2 ** (attempt - 1)))
+                # Longer outages are left to flush_pending_forwards
+                if loop.time() + delay > retry_until:
+                    raise
+
+            # Don't wait past the shutdown deadline, the caller queues the message instead
+            if shutdown_deadline_passed(delay):
+                raise
+
+            logger.warning(f"Send to chat {kwargs.get('chat_id')} failed ({e}), retry {attempt} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+def build_forward(message, header, user_chat_id, user_id):
+    """Describe a user message so it can be delivered now or stored in the queue"""
+    forward = {
+        'header': header,
+        'parse_mode': ParseMode.HTML,
+        'user_chat_id': user_chat_id,
+        'user_id': user_id
+    }
+
+    if message.text:
+        # Plain escaping rather than message.text_html, which leaves text_link URLs unescaped
+        forward.update({'type': 'text', 'content': html.escape(message.text, quote=False)})
+    elif message.sticker:
+        forward.update({'type': 'sticker', 'file_id': message.sticker.file_id})
+    elif message.voice:
+        forward.update({'type': 'voice', 'file_id': message.voice.file_id})
+    elif message.document:
+        forward.update({'type': 'document', 'file_id': message.document.file_id})
+    elif message.photo:
+        # Photo (send the largest available size)
+        forward.update({'type': 'photo', 'file_id': message.photo[-1].file_id})
+    elif message.video:
+        forward.update({'type': 'video', 'file_id': message.video.file_id})
+    elif message.animation:
+        forward.update({'type': 'animation', 'file_id': message.animation.file_id})
+    elif message.video_note:
+        logger.info("Received video_note")
+        forward.update({'type': 'video_note', 'file_id': message.video_note.file_id})
+    else:
+        forward.update({'type': 'unsupported'})
+
+    return forward
+
+
+async def deliver_forward(bot, forward):
+    """Send a forward to the admin chat and remember where replies should go"""
+    header = forward['header']
+    message_type = forward['type']
+    parse_mode = forward['parse_mode']
+
+    if message_type == 'text':
+        admin_msg = await send_with_retry(
+            bot.send_message,
+            chat_id=ADMIN_CHAT_ID,
+            text=f"{header}{forward['content']}",
+            parse_mode=parse_mode
+        )
+    elif message_type in ('sticker', 'video_note'):
+        # Stickers and video notes can't have captions
+        send_func = bot.send_sticker if message_type == 'sticker' else bot.send_video_note
+        admin_msg = await send_with_retry(
+            send_func,
+            chat_id=ADMIN_CHAT_ID,
+            **{message_type: forward['file_id']}
+        )
+    elif message_type == 'unsupported':
+        admin_msg = await send_with_retry(
+            bot.send_message,
+            chat_id=ADMIN_CHAT_ID,
+            text=f"{header}[Unsupported message type]",
+            parse_mode=parse_mode
+        )
+    else:
+        # voice, document, photo, video and animation all take the header as caption
+        admin_msg = await send_with_retry(
+            getattr(bot, f"send_{message_type}"),
+            chat_id=ADMIN_CHAT_ID,
+            caption=header,
+            parse_mode=parse_mode,
+            **{message_type: forward['file_id']}
+        )
+
+    # Store mapping in database
+    save_forwarded_message(admin_msg.message_id, forward['user_chat_id'], forward['user_id'])
+
+    if message_type in ('sticker', 'video_note'):
+        # Send the header as a separate message. The media itself already arrived,
+        # so a failure here must not put the forward back in the queue.
+        try:
+            await send_with_retry(
+                bot.send_message,
+                chat_id=ADMIN_CHAT_ID,
+                text=header,
+                parse_mode=parse_mode,
+                reply_to_message_id=admin_msg.message_id
+            )
+        except TelegramError as e:
+            logger.error(f"Error sending header for forwarded {message_type}: {e}")
+
+    return admin_msg
+
+
+async def forward_to_admin(bot, forward, drain_inline=False):
+    """Deliver a forward to the admin chat, queueing it if the admin chat is unavailable.
+
+    With drain_inline the older queued forwards are delivered first, for setups where no
+    background job drains the queue.
+
+    Returns True if the forward was delivered, False if it was queued and None if the admin
+    chat refused it for good.
+    """
+    if admin_circuit_is_open() or shutdown_deadline_passed():
+        enqueue_forward(forward)
+        return False
+
+    # Queue behind any older forwards so the admins see each user's messages in order
+    if has_pending_forwards() and not (drain_inline and await drain_pending_forwards(bot)):
+        enqueue_forward(forward)
+        return False
+
+    try:
+        await deliver_forward(bot, forward)
+    except TelegramError as e:
+        if not should_queue_forward(e):
+            logger.error(f"Admin chat rejected forward {forward}: {e}")
+            return None
+        logger.error(f"Error forwarding message to admin chat: {e}")
+        record_admin_failure(e)
+        enqueue_forward(forward)
+        return False
+
+    record_admin_success()
+    return True
+
+
+async def drain_pending_forwards(bot):
+    """Deliver queued forwards oldest first. Returns True once the queue is empty."""
+    # New forwards queue up behind these, so keep going until the queue is empty
+    while True:
+        batch = get_pending_forwards(PENDING_FLUSH_BATCH)
+        if not batch:
+            return True
+
+        for pending in batch:
+            if shutdown_deadline_passed():
+                return False
+            try:
+                await deliver_forward(bot, pending['forward'])
+            except TelegramError as e:
+                if should_queue_forward(e):
+                    # Keep the order of the queue, try again on the next run
+                    logger.warning(f"Admin chat still unavailable, {e}")
+                    mark_pending_forward_failed(pending['id'])
+                    record_admin_failure(e)
+                    return False
+                # Retrying will never fix this one, log it in full so it isn't lost silently
+                logger.error(f"Dropping undeliverable forward {pending['forward']}: {e}")
+                delete_pending_forward(pending['id'])
+                continue
+
+            record_admin_success()
+            delete_pending_forward(pending['id'])
+            logger.info(f"Delivered queued forward {pending['id']} after {pending['attempts']} failed attempts")
+
+
+# Job that drains the queue of forwards the admin chat didn't accept
+async def flush_pending_forwards(context: ContextTypes.DEFAULT_TYPE):
+    # Only the leader drains the queue, otherwise workers would deliver forwards twice
+    if not worker_state['leader'] or admin_circuit_is_open():
+        return
+
+    await drain_pending_forwards(context.bot)
+
+
 # Message handler for all messages
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"Chat ID: {update.effective_chat.id}")
@@ -280,125 +917,251 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # User has selected a room today, proceed with forwarding the message
     user_info = get_user_info(user_id)
-    room = user_info.get("room", "Unknown Room")
-    username = user_info.get("username", f"user_{user_id}")
 
-    # Message header for the admin
-    header = f"*Message from {username}* | *Room: {room}*\n\n"
+    # Message header for the admin, rendered when the user picked their room
+    forward = build_forward(update.message, user_info["header"], update.effective_chat.id, user_id)
+    # Without a JobQueue nothing drains the queue in the background, so catch up here
+    delivered = await forward_to_admin(context.bot, forward, drain_inline=context.application.job_queue is None)
 
-    # Forward the message to admin
-    ADMIN_CHAT_ID = -4796230051
-
-    # Handle different types of messages
-    if update.message.text:
-        # Text message
-        admin_msg = await context.bot.send_message(
-            chat_id=ADMIN_CHAT_ID,
-            text=f"{header}{update.message.text}",
-            parse_mode=ParseMode.MARKDOWN
+    # Acknowledge receipt to user
+    if delivered:
+        await update.message.reply_text("Message sent ✓")
+    elif delivered is False:
+        await update.message.reply_text("Message received ✓ It will be delivered to the admins shortly.")
+    else:
+        await update.message.reply_text("Sorry, this message couldn't be delivered to the admins. "
+                                        "Please try sending it again in a different form.")
+
+# InputMedia classes for the kinds of media an album can contain
+INPUT_MEDIA_TYPES = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+    'audio': InputMediaAudio
+}
+
+
+def render_broadcast_html(message, caption=False):
+    """message.text_html or message.caption_html, with link URLs escaped.
+
+    PTB writes text_link URLs into the href attribute as they are, so a quote or & in a
+    link breaks the HTML Telegram parses when the broadcast is sent.
+    """
+    text = message.caption if caption else message.text
+    if text is None:
+        return None
+    entities = message.caption_entities if caption else message.entities
+
+    safe_entities = [
+        MessageEntity(
+            entity.type, entity.offset, entity.length,
+            url=html.escape(entity.url, quote=True) if entity.url else None,
+            user=entity.user,
+            language=html.escape(entity.language, quote=True) if entity.language else None,
+            custom_emoji_id=entity.custom_emoji_id
         )
-        # Store mapping in database instead of context
-        save_forwarded_message(admin_msg.message_id, update.effective_chat.id, user_id)
+        for entity in entities
+    ]
+    if caption:
+        return Message(message.message_id, message.date, message.chat,
+                       caption=text, caption_entities=safe_entities).caption_html
+    return Message(message.message_id, message.date, message.chat, text=text, entities=safe_entities).text_html
+
+
+def build_album_media(message):
+    """Describe one part of an album, or return None if it can't be part of one"""
+    caption = render_broadcast_html(message, caption=True)
+    if message.photo:
+        return {'type': 'photo', 'file_id': message.photo[-1].file_id, 'caption': caption}
+    elif message.video:
+        return {'type': 'video', 'file_id': message.video.file_id, 'caption': caption}
+    elif message.document:
+        return {'type': 'document', 'file_id': message.document.file_id, 'caption': caption}
+    elif message.audio:
+        return {'type': 'audio', 'file_id': message.audio.file_id, 'caption': caption}
+    return None
 
-    elif update.message.sticker:
-        # Sticker
-        admin_msg = await context.bot.send_sticker(
-            chat_id=ADMIN_CHAT_ID,
-            sticker=update.message.sticker.file_id
-        )
-        # Send the header as a separate message
-        text_msg = await context.bot.send_message(
-            chat_id=ADMIN_CHAT_ID,
-            text=header,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_to_message_id=admin_msg.message_id
-        )
-        # Store mapping in database
-        save_forwarded_message(admin_msg.message_id, update.effective_chat.id, user_id)
 
-    elif update.message.voice:
-        # Voice message
-        admin_msg = await context.bot.send_voice(
-            chat_id=ADMIN_CHAT_ID,
-            voice=update.message.voice.file_id,
-            caption=header,
-            parse_mode=ParseMode.MARKDOWN
-        )
-        # Store mapping in database
-        save_forwarded_message(admin_msg.message_id, update.effective_chat.id, user_id)
+def build_broadcast_item(message):
+    """Describe an admin message so it can be re-sent to every recipient by file_id.
+
+    Text and captions are kept as HTML rendered from the message entities, so the
+    formatting the admin used is reproduced exactly (see render_broadcast_html).
+    """
+    caption = render_broadcast_html(message, caption=True)
+
+    if message.media_group_id:
+        media = build_album_media(message)
+        if media:
+            return {'type': 'media_group', 'media_group_id': message.media_group_id, 'media': [media]}
+
+    if message.text:
+        return {'type': 'text', 'content': render_broadcast_html(message)}
+    elif message.photo:
+        return {'type': 'photo', 'file_id': message.photo[-1].file_id, 'caption': caption}
+    elif message.video:
+        return {'type': 'video', 'file_id': message.video.file_id, 'caption': caption}
+    elif message.animation:
+        # Checked before document, GIFs carry both
+        return {'type': 'animation', 'file_id': message.animation.file_id, 'caption': caption}
+    elif message.document:
+        return {'type': 'document', 'file_id': message.document.file_id, 'caption': caption}
+    elif message.audio:
+        return {'type': 'audio', 'file_id': message.audio.file_id, 'caption': caption}
+    elif message.voice:
+        return {'type': 'voice', 'file_id': message.voice.file_id, 'caption': caption}
+    elif message.sticker:
+        return {'type': 'sticker', 'file_id': message.sticker.file_id}
+    elif message.video_note:
+        return {'type': 'video_note', 'file_id': message.video_note.file_id}
+    elif message.location or message.contact or message.poll or message.dice:
+        # Copied from the admin chat as is, venues are locations too
+        return {'type': 'copy', 'message_id': message.message_id}
+
+    # Not something the bot can re-send
+    return None
 
-    elif update.message.document:
-        # Document
-        admin_msg = await context.bot.send_document(
-            chat_id=ADMIN_CHAT_ID,
-            document=update.message.document.file_id,
-            caption=header,
-            parse_mode=ParseMode.MARKDOWN
-        )
-        # Store mapping in database
-        save_forwarded_message(admin_msg.message_id, update.effective_chat.id, user_id)
 
-    elif update.message.photo:
-        # Photo (send the largest available size)
-        admin_msg = await context.bot.send_photo(
-            chat_id=ADMIN_CHAT_ID,
-            photo=update.message.photo[-1].file_id,
-            caption=header,
-            parse_mode=ParseMode.MARKDOWN
-        )
-        # Store mapping in database
-        save_forwarded_message(admin_msg.message_id, update.effective_chat.id, user_id)
+async def send_broadcast_item(bot, chat_id, item):
+    """Send one message of a broadcast to one chat"""
+    message_type = item['type']
 
-    elif update.message.video:
-        # Video
-        admin_msg = await context.bot.send_video(
-            chat_id=ADMIN_CHAT_ID,
-            video=update.message.video.file_id,
-            caption=header,
-            parse_mode=ParseMode.MARKDOWN
+    if message_type == 'text':
+        await send_with_retry(
+            bot.send_message,
+            flood_wait_limit=SEND_MAX_RETRY_AFTER,
+            chat_id=chat_id,
+            text=item['content'],
+            parse_mode=ParseMode.HTML
         )
-        # Store mapping in database
-        save_forwarded_message(admin_msg.message_id, update.effective_chat.id, user_id)
-
-    elif update.message.animation:
-        # Animation/GIF
-        admin_msg = await context.bot.send_animation(
-            chat_id=ADMIN_CHAT_ID,
-            animation=update.message.animation.file_id,
-            caption=header,
-            parse_mode=ParseMode.MARKDOWN
+    elif message_type == 'media_group':
+        media = [
+            INPUT_MEDIA_TYPES[part['type']](media=part['file_id'], caption=part.get('caption'), parse_mode=ParseMode.HTML)
+            for part in item['media']
+        ]
+        await send_with_retry(
+            bot.send_media_group,
+            flood_wait_limit=SEND_MAX_RETRY_AFTER,
+            chat_id=chat_id,
+            media=media
         )
-        # Store mapping in database
-        save_forwarded_message(admin_msg.message_id, update.effective_chat.id, user_id)
-
-    elif update.message.video_note:
-        logger.info("Received video_note")
-        admin_msg = await context.bot.send_video_note(
-            chat_id=ADMIN_CHAT_ID,
-            video_note=update.message.video_note.file_id
+    elif message_type == 'copy':
+        await send_with_retry(
+            bot.copy_message,
+            flood_wait_limit=SEND_MAX_RETRY_AFTER,
+            chat_id=chat_id,
+            from_chat_id=ADMIN_CHAT_ID,
+            message_id=item['message_id']
         )
-        # Send the header as a separate message since video_note can't have captions
-        text_msg = await context.bot.send_message(
-            chat_id=ADMIN_CHAT_ID,
-            text=header,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_to_message_id=admin_msg.message_id
+    elif message_type in ('sticker', 'video_note'):
+        # Stickers and video notes can't have captions
+        await send_with_retry(
+            getattr(bot, f"send_{message_type}"),
+            flood_wait_limit=SEND_MAX_RETRY_AFTER,
+            chat_id=chat_id,
+            **{message_type: item['file_id']}
         )
-        # Store mapping in database
-        save_forwarded_message(admin_msg.message_id, update.effective_chat.id, user_id)
-
     else:
-        # Other types of messages
-        admin_msg = await context.bot.send_message(
-            chat_id=ADMIN_CHAT_ID,
-            text=f"{header}[Unsupported message type]",
-            parse_mode=ParseMode.MARKDOWN
+        # photo, video, animation, document, audio and voice
+        await send_with_retry(
+            getattr(bot, f"send_{message_type}"),
+            flood_wait_limit=SEND_MAX_RETRY_AFTER,
+            chat_id=chat_id,
+            caption=item.get('caption'),
+            parse_mode=ParseMode.HTML,
+            **{message_type: item['file_id']}
         )
-        # Store mapping in database
-        save_forwarded_message(admin_msg.message_id, update.effective_chat.id, user_id)
 
-    # Acknowledge receipt to user
-    await update.message.reply_text("Message sent ✓")
+
+async def send_broadcast_bundle(bot, chat_id, bundle):
+    """Send all messages of a broadcast to one chat, in the order the admin sent them"""
+    for item in bundle:
+        await send_broadcast_item(bot, chat_id, item)
+
+
+async def fan_out_broadcast(bot, entries):
+    """Send each (user_id, bundle) entry in order.
+
+    Stops early on a flood wait too long to sit out, on network trouble and at the shutdown
+    deadline. Returns (success_count, remaining, retry_after): remaining holds the entries not
+    sent yet, the first one cut down to the messages its user hasn't received, and retry_after
+    is how long Telegram asked us to wait, or None.
+    """
+    success_count = 0
+    for index, (user_id, bundle) in enumerate(entries):
+        for position, item in enumerate(bundle):
+            remaining = [(user_id, bundle[position:])] + entries[index + 1:]
+            if shutdown_deadline_passed():
+                return success_count, remaining, None
+            try:
+                await send_broadcast_item(bot, user_id, item)
+            except Exception as e:
+                if isinstance(e, TelegramError) and is_transient_error(e):
+                    # Every later recipient would hit the same problem, stop here
+                    logger.warning(f"Pausing broadcast at user {user_id}: {e}")
+                    retry_after = get_retry_after_seconds(e) if isinstance(e, RetryAfter) else None
+                    return success_count, remaining, retry_after
+                logger.error(f"Error sending message to user {user_id}: {e}")
+                break
+        else:
+            success_count += 1
+
+    return success_count, [], None
+
+
+async def send_broadcast_outbox(bot):
+    """Send the broadcasts waiting in the outbox, sitting out flood waits.
+
+    Returns (success_count, total) for the entries it went through, or None if it stopped early
+    and left the rest for the next run.
+    """
+    loop = asyncio.get_running_loop()
+    entries = get_broadcast_outbox()
+    success_count = 0
+
+    for entry in entries:
+        pending = [(entry['user_id'], entry['bundle'])]
+        while True:
+            sent, pending, retry_after = await fan_out_broadcast(bot, pending)
+            success_count += sent
+            if not pending:
+                break
+
+            # Keep only what the user hasn't received yet
+            update_broadcast_outbox_entry(entry['id'], pending[0][1])
+            if retry_after is None or shutdown_deadline_passed(retry_after):
+                # Network trouble or shutting down, the next run picks it up
+                return None
+
+            logger.warning(f"Broadcast outbox waiting {retry_after}s for Telegram's flood limit")
+            # Short steps, so a shutdown doesn't have to wait for the flood limit
+            resume_at = loop.time() + retry_after
+            while loop.time() < resume_at:
+                if shutdown_state['stopping']:
+                    return None
+                await asyncio.sleep(min(1, resume_at - loop.time()))
+
+        # Delivered, or refused for good (blocked the bot, deleted account)
+        delete_broadcast_outbox_entry(entry['id'])
+
+    return success_count, len(entries)
+
+
+# Job that finishes broadcasts that were paused by a flood wait or a shutdown
+async def drain_broadcast_outbox(context: ContextTypes.DEFAULT_TYPE):
+    if not worker_state['leader'] or not has_broadcast_outbox():
+        return
+
+    result = await send_broadcast_outbox(context.bot)
+    if result is None:
+        return
+
+    success_count, total = result
+    await context.bot.send_message(
+        chat_id=ADMIN_CHAT_ID,
+        text=f"Finished a paused broadcast: sent to {success_count} out of {total} remaining users."
+    )
+
 
 # Function to get admin room selection keyboard
 def get_admin_room_keyboard():
@@ -420,24 +1183,23 @@ async def handle_admin_command(update: Update, context: ContextTypes.DEFAULT_TYP
     if update.effective_chat.id != -4796230051:  # Using the same admin chat ID from your code
         return
     # If it's not a command and we're not expecting a broadcast message, return immediately
-    if not update.message.text.startswith('/') and 'pending_broadcast' not in context.bot_data:
+    # The pending broadcast lives in shared storage so every worker sees the same session
+    if not (update.message.text or '').startswith('/') and not get_pending_broadcast():
         return
     message_text = update.message.text
 
-    # Initialize pending_broadcast if it doesn't exist
-    if 'pending_broadcast' not in context.bot_data:
-        context.bot_data['pending_broadcast'] = {}
-
     # Handle the /send_all command
     if message_text == '/send_all':
-        context.bot_data['pending_broadcast'] = {
+        save_pending_broadcast({
             'type': 'all',
             'room': None,
-            'message': None,
+            'admin_id': update.effective_user.id,
+            'messages': [],
             'awaiting_message': True
-        }
+        })
         await update.message.reply_text(
-            "Please send the message you want to broadcast to all users."
+            "Please send the message you want to broadcast to all users. "
+            "You can send several messages, including albums."
         )
         return
 
@@ -451,14 +1213,20 @@ async def handle_admin_command(update: Update, context: ContextTypes.DEFAULT_TYP
 
     # Handle the /confirm command
     if message_text == '/confirm':
-        pending = context.bot_data.get('pending_broadcast', {})
+        pending = get_pending_broadcast()
 
-        if not pending or not pending.get('message'):
+        if not pending or not pending.get('messages'):
             await update.message.reply_text(
                 "Nothing to confirm. Please use /send_all or /send_room first."
             )
             return
 
+        if update.effective_user.id != pending.get('admin_id'):
+            await update.message.reply_text(
+                "Only the admin who started this broadcast can confirm it. Use /cancel to abort it."
+            )
+            return
+
         # Get the users to send to
         if pending['type'] == 'all':
             user_ids = get_users_by_room()
@@ -472,152 +1240,112 @@ async def handle_admin_command(update: Update, context: ContextTypes.DEFAULT_TYP
             await update.message.reply_text(
                 f"No {target_desc} found to send message to."
             )
-            context.bot_data['pending_broadcast'] = {}
+            clear_pending_broadcast()
             return
 
-        # Send the message to each user
-        message_data = pending['message']
-        message_type = message_data['type']
-        success_count = 0
+        bundle = pending['messages']
 
-        for user_id in user_ids:
-            try:
-                if message_type == 'text':
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text=message_data['content'],
-                        parse_mode=ParseMode.MARKDOWN
-                    )
-                elif message_type == 'photo':
-                    await context.bot.send_photo(
-                        chat_id=user_id,
-                        photo=message_data['file_id'],
-                        caption=message_data.get('caption')
-                    )
-                elif message_type == 'video':
-                    await context.bot.send_video(
-                        chat_id=user_id,
-                        video=message_data['file_id'],
-                        caption=message_data.get('caption')
-                    )
-                elif message_type == 'document':
-                    await context.bot.send_document(
-                        chat_id=user_id,
-                        document=message_data['file_id'],
-                        caption=message_data.get('caption')
-                    )
-                elif message_type == 'voice':
-                    await context.bot.send_voice(
-                        chat_id=user_id,
-                        voice=message_data['file_id'],
-                        caption=message_data.get('caption')
-                    )
-                elif message_type == 'sticker':
-                    await context.bot.send_sticker(
-                        chat_id=user_id,
-                        sticker=message_data['file_id']
-                    )
-                elif message_type == 'animation':
-                    await context.bot.send_animation(
-                        chat_id=user_id,
-                        animation=message_data['file_id'],
-                        caption=message_data.get('caption')
-                    )
-                elif message_type == 'video_note':
-                    await context.bot.send_video_note(
-                        chat_id=user_id,
-                        video_note=message_data['file_id']
-                    )
-                success_count += 1
-            except Exception as e:
-                logger.error(f"Error sending message to user {user_id}: {e}")
+        # Send the bundle to the admin chat first. If Telegram rejects it
+        # (bad formatting, expired file), that costs one call instead of one per user.
+        try:
+            await send_broadcast_bundle(context.bot, ADMIN_CHAT_ID, bundle)
+        except BadRequest as e:
+            # The content itself is invalid, sending it again won't help
+            logger.error(f"Broadcast failed validation in the admin chat: {e}")
+            await update.message.reply_text(
+                f"Broadcast was not sent, Telegram rejected it: {e}\n"
+                f"Please start again with /send_all or /send_room."
+            )
+            clear_pending_broadcast()
+            return
+        except TelegramError as e:
+            # Timeouts, flood waits and the like: keep the bundle so the admin can retry
+            logger.error(f"Error sending broadcast preview to the admin chat: {e}")
+            await update.message.reply_text(
+                f"Broadcast was not sent, Telegram is not responding properly right now: {e}\n"
+                f"The messages are kept. Please try /confirm again in a moment, or /cancel to abort."
+            )
+            return
+
+        # Send the bundle to each user
+        success_count, remaining, retry_after = await fan_out_broadcast(
+            context.bot, [(user_id, bundle) for user_id in user_ids]
+        )
+        if remaining:
+            # Finished from the outbox once Telegram lets us, or after the restart
+            checkpoint_broadcast(remaining)
 
         # Clear the pending broadcast
-        context.bot_data['pending_broadcast'] = {}
+        clear_pending_broadcast()
 
-        await update.message.reply_text(
-            f"Message sent to {success_count} out of {len(user_ids)} {target_desc}."
+        result_text = (
+            f"The preview above was accepted. {len(bundle)} message(s) sent to "
+            f"{success_count} out of {len(user_ids)} {target_desc}."
         )
+        if remaining and shutdown_state['stopping']:
+            result_text += f" The bot is restarting, the remaining {len(remaining)} will get it after the restart."
+        elif remaining:
+            wait_text = f" for {retry_after:.0f}s" if retry_after else ""
+            result_text += (
+                f" Telegram asked the bot to hold off{wait_text}, "
+                f"the remaining {len(remaining)} will get it in the background."
+            )
+        await update.message.reply_text(result_text)
+
+        # Without a JobQueue nothing drains the outbox in the background, so finish it here
+        if remaining and context.application.job_queue is None and not shutdown_state['stopping']:
+            result = await send_broadcast_outbox(context.bot)
+            if result:
+                await update.message.reply_text(
+                    f"Finished the broadcast: sent to {result[0]} out of {result[1]} remaining users."
+                )
         return
 
     # Handle the /cancel command
     if message_text == '/cancel':
-        if context.bot_data.get('pending_broadcast'):
-            context.bot_data['pending_broadcast'] = {}
+        if get_pending_broadcast():
+            clear_pending_broadcast()
             await update.message.reply_text("Broadcast cancelled.")
         else:
             await update.message.reply_text("No pending broadcast to cancel.")
         return
 
     # Handle message for pending broadcast
-    pending = context.bot_data.get('pending_broadcast', {})
+    pending = get_pending_broadcast()
     if pending and pending.get('awaiting_message'):
         message = update.message
+        bundle = pending.get('messages', [])
 
-        # Store the message based on its type
-        if message.text and not message.text.startswith('/'):
-            pending['message'] = {
-                'type': 'text',
-                'content': message.text
-            }
-        elif message.photo:
-            pending['message'] = {
-                'type': 'photo',
-                'file_id': message.photo[-1].file_id,
-                'caption': message.caption
-            }
-        elif message.video:
-            pending['message'] = {
-                'type': 'video',
-                'file_id': message.video.file_id,
-                'caption': message.caption
-            }
-        elif message.document:
-            pending['message'] = {
-                'type': 'document',
-                'file_id': message.document.file_id,
-                'caption': message.caption
-            }
-        elif message.voice:
-            pending['message'] = {
-                'type': 'voice',
-                'file_id': message.voice.file_id,
-                'caption': message.caption
-            }
-        elif message.sticker:
-            pending['message'] = {
-                'type': 'sticker',
-                'file_id': message.sticker.file_id
-            }
-        elif message.animation:
-            pending['message'] = {
-                'type': 'animation',
-                'file_id': message.animation.file_id,
-                'caption': message.caption
-            }
-        elif message.video_note:
-            pending['message'] = {
-                'type': 'video_note',
-                'file_id': message.video_note.file_id
-            }
-        else:
-            await update.message.reply_text(
-                "This message type is not supported for broadcasting. Please send text, photo, video, document, voice, sticker, animation, or video note."
-            )
+        # Other admins keep chatting while a broadcast is put together, only collect the initiator's messages
+        if message.from_user is None or message.from_user.id != pending.get('admin_id'):
+            return
+
+        # Telegram delivers an album as separate messages, collect them into one item
+        if message.media_group_id and bundle and bundle[-1].get('media_group_id') == message.media_group_id:
+            media = build_album_media(message)
+            if media:
+                bundle[-1]['media'].append(media)
+                save_pending_broadcast(pending)
+                return
+
+        item = build_broadcast_item(message)
+        if item is None:
+            await update.message.reply_text("This kind of message can't be broadcast, it was not added.")
             return
 
-        pending['awaiting_message'] = False
-        context.bot_data['pending_broadcast'] = pending
+        bundle.append(item)
+        pending['messages'] = bundle
+        save_pending_broadcast(pending)
 
-        # Ask for confirmation
+        # Ask for more messages or confirmation
         if pending['type'] == 'all':
             target_desc = "all users"
         else:
             target_desc = f"users in {pending['room']}"
 
         await update.message.reply_text(
-            f"You're about to send this message to {target_desc}.\n"
-            f"Please reply with /confirm to send or /cancel to abort."
+            f"Added to the broadcast ({len(bundle)} so far). You can send more messages, they will be delivered in order.\n"
+            f"Please reply with /confirm to send to {target_desc} or /cancel to abort."
         )
 
 
@@ -632,15 +1360,17 @@ async def admin_room_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     room = query.data.replace('admin_select_', '')
 
     # Initialize the pending broadcast
-    context.bot_data['pending_broadcast'] = {
+    save_pending_broadcast({
         'type': 'room',
         'room': room,
-        'message': None,
+        'admin_id': query.from_user.id,
+        'messages': [],
         'awaiting_message': True
-    }
+    })
 
     await query.edit_message_text(
-        f"You've selected {room}. Please send the message you want to broadcast to users in this room."
+        f"You've selected {room}. Please send the message you want to broadcast to users in this room. "
+        f"You can send several messages, including albums."
     )
 
 
@@ -678,8 +1408,8 @@ async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if update.message.text:
             await context.bot.send_message(
                 chat_id=original_chat_id,
-                text=f"*Reply from admin:*\n\n{update.message.text}",
-                parse_mode=ParseMode.MARKDOWN
+                text=f"<b>Reply from admin:</b>\n\n{html.escape(update.message.text, quote=False)}",
+                parse_mode=ParseMode.HTML
             )
         elif update.message.sticker:
             await context.bot.send_sticker(
@@ -734,11 +1464,461 @@ async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
         logger.error(f"Error sending reply to user: {e}")
         await update.message.reply_text(f"Error sending reply: {e}")
 
-# Main function to run the bot
-# Replace the main function with this fixed version
-def main():
-    # Create and run the bot
-    app = ApplicationBuilder().token("BotToken").build()
+# Profiler state. No sampling thread exists while the profiler is off.
+profiler_state = {
+    'thread': None,
+    'stop_event': None,
+    'samples': None,
+    'started_at': None,
+    'task': None
+}
+
+# Baseline for /memdiff
+memory_state = {
+    'snapshot': None
+}
+
+
+def diagnostics_filename(kind):
+    return f"{kind}_{worker_state['name'].replace(':', '_')}_{datetime.now():%Y%m%d_%H%M%S}.txt"
+
+
+def sample_stacks(thread_id, interval, stop_event, samples):
+    """Runs in a background thread and counts the stacks the event loop thread is in"""
+    while not stop_event.wait(interval):
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+            frame = frame.f_back
+        samples[';'.join(reversed(stack))] += 1
+
+
+def format_profile(samples, duration):
+    """Render samples as a summary followed by collapsed stacks (flamegraph.pl / speedscope format)"""
+    total = sum(samples.values())
+    own = Counter()
+    for stack, count in samples.items():
+        own[stack.rsplit(';', 1)[-1]] += count
+
+    lines = [f"{total} samples over {duration:.1f}s, every {PROFILE_SAMPLE_INTERVAL * 1000:.0f}ms", "", "Top functions by own samples:"]
+    for function, count in own.most_common(PROFILE_TOP_FUNCTIONS):
+        lines.append(f"{count:8d} {count / total:6.1%}  {function}")
+    lines += ["", "Collapsed stacks:"]
+    for stack, count in samples.most_common():
+        lines.append(f"{stack} {count}")
+    return '\n'.join(lines)
+
+
+async def stop_profiler(bot):
+    """Stop the sampling thread and send the results to the admin chat"""
+    thread = profiler_state['thread']
+    if thread is None:
+        return
+
+    profiler_state['stop_event'].set()
+    thread.join()
+    samples = profiler_state['samples']
+    duration = (datetime.now() - profiler_state['started_at']).total_seconds()
+    profiler_state.update({'thread': None, 'stop_event': None, 'samples': None, 'started_at': None, 'task': None})
+
+    if not samples:
+        await bot.send_message(chat_id=ADMIN_CHAT_ID, text="Profiler stopped without collecting any samples.")
+        return
+
+    await bot.send_document(
+        chat_id=ADMIN_CHAT_ID,
+        document=io.BytesIO(format_profile(samples, duration).encode()),
+        filename=diagnostics_filename('profile'),
+        caption=f"Profile of {worker_state['name']} ({duration:.1f}s)"
+    )
+
+
+async def stop_profiler_after(bot, seconds):
+    await asyncio.sleep(seconds)
+    await stop_profiler(bot)
+
+
+async def measure_loop_lag():
+    """Measure how late the event loop wakes up a sleeping coroutine"""
+    loop = asyncio.get_running_loop()
+    lags = []
+    for _ in range(LOOP_LAG_SAMPLES):
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lags.append(loop.time() - started - LOOP_LAG_INTERVAL)
+    return lags
+
+
+async def run_diagnostics(app, command, args):
+    """Run /profile, /memdiff or /loopstats in this process and send the result to the admin chat"""
+
+    if command == '/profile':
+        if args and args[0] == 'stop':
+            if profiler_state['thread'] is None:
+                await app.bot.send_message(chat_id=ADMIN_CHAT_ID, text="The profiler is not running.")
+                return
+            profiler_state['task'].cancel()
+            await stop_profiler(app.bot)
+            return
+
+        if profiler_state['thread'] is not None:
+            await app.bot.send_message(
+                chat_id=ADMIN_CHAT_ID,
+                text="The profiler is already running. Use /profile stop to stop it early."
+            )
+            return
+
+        try:
+            seconds = int(args[0]) if args else PROFILE_DEFAULT_SECONDS
+        except ValueError:
+            await app.bot.send_message(chat_id=ADMIN_CHAT_ID, text="Usage: /profile [seconds] [wN] or /profile stop [wN]")
+            return
+        seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+
+        stop_event = threading.Event()
+        samples = Counter()
+        thread = threading.Thread(
+            target=sample_stacks,
+            args=(threading.get_ident(), PROFILE_SAMPLE_INTERVAL, stop_event, samples),
+            name="profiler",
+            daemon=True
+        )
+        thread.start()
+        profiler_state.update({
+            'thread': thread,
+            'stop_event': stop_event,
+            'samples': samples,
+            'started_at': datetime.now(),
+            'task': app.create_task(stop_profiler_after(app.bot, seconds))
+        })
+        await app.bot.send_message(chat_id=ADMIN_CHAT_ID, text=f"Profiling {worker_state['name']} for {seconds}s.")
+        return
+
+    if command == '/memdiff':
+        if args and args[0] == 'stop':
+            tracemalloc.stop()
+            memory_state['snapshot'] = None
+            await app.bot.send_message(chat_id=ADMIN_CHAT_ID, text="Stopped tracing memory allocations.")
+            return
+
+        if not tracemalloc.is_tracing():
+            # Tracing slows down every allocation, so it only runs between /memdiff and /memdiff stop
+            tracemalloc.start(MEMORY_TRACE_FRAMES)
+            memory_state['snapshot'] = tracemalloc.take_snapshot()
+            await app.bot.send_message(
+                chat_id=ADMIN_CHAT_ID,
+                text="Started tracing memory allocations. Send /memdiff again to see what changed, "
+                     "and /memdiff stop when you are done."
+            )
+            return
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+        ])
+        stats = snapshot.compare_to(memory_state['snapshot'], 'lineno')
+        memory_state['snapshot'] = snapshot
+
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Traced memory: {current / 1024:.1f} KiB now, {peak / 1024:.1f} KiB peak", "",
+                 f"Top {MEMORY_TOP_STATS} changes since the previous /memdiff:"]
+        lines += [str(stat) for stat in stats[:MEMORY_TOP_STATS]]
+
+        await app.bot.send_document(
+            chat_id=ADMIN_CHAT_ID,
+            document=io.BytesIO('\n'.join(lines).encode()),
+            filename=diagnostics_filename('memdiff'),
+            caption=f"Memory diff of {worker_state['name']}"
+        )
+        return
+
+    if command == '/loopstats':
+        lags = await measure_loop_lag()
+        tasks = asyncio.all_tasks()
+        task_kinds = Counter(
+            getattr(task.get_coro(), '__qualname__', type(task.get_coro()).__name__) for task in tasks
+        )
+        counts = get_pending_work_counts()
+
+        lines = [
+            f"Worker: {worker_state['name']} (leader: {worker_state['leader']})",
+            f"Event loop lag over {LOOP_LAG_SAMPLES} samples: "
+            f"min {min(lags) * 1000:.1f}ms, avg {sum(lags) / len(lags) * 1000:.1f}ms, max {max(lags) * 1000:.1f}ms",
+            f"Queued: {counts['pending_forwards']} forwards, {counts['broadcast_outbox']} broadcast deliveries, "
+            f"{counts['update_queue']} updates",
+            f"Admin circuit: {'open' if admin_circuit_is_open() else 'closed'}, {admin_circuit['failures']} recent failures",
+            "",
+            f"{len(tasks)} tasks:"
+        ]
+        lines += [f"{count:6d}  {kind}" for kind, count in task_kinds.most_common()]
+        if worker_state['num_workers'] > 1:
+            lines += ["", f"Only this worker is covered. Add w0 to w{worker_state['num_workers'] - 1} "
+                          f"to a diagnostics command to inspect another one."]
+
+        await app.bot.send_document(
+            chat_id=ADMIN_CHAT_ID,
+            document=io.BytesIO('\n'.join(lines).encode()),
+            filename=diagnostics_filename('loopstats'),
+            caption=f"Event loop stats of {worker_state['name']}"
+        )
+
+
+async def run_pending_diagnostics(app):
+    """Run a diagnostics command the admin addressed to this worker"""
+    request = take_shared_state(f"diagnostics_request_{worker_state['worker_id']}")
+    if not request:
+        return
+    try:
+        await run_diagnostics(app, request['command'], request['args'])
+    except Exception as e:
+        # This runs inside the polling loop, a failed report must not take the worker down
+        logger.error(f"Error running {request['command']} for the admin chat: {e}")
+
+
+# Command handler for /profile, /memdiff and /loopstats in the admin chat
+async def handle_diagnostics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    command = update.message.text.split()[0].split('@')[0]
+    args = context.args or []
+
+    # Only the worker owning the admin chat's shard sees these commands. A trailing wN
+    # hands the command to worker N through shared storage instead.
+    own_worker_id = worker_state['worker_id'] if worker_state['worker_id'] is not None else 0
+    target_worker_id = own_worker_id
+    if args and re.fullmatch(r'w\d+', args[-1]):
+        target_worker_id = int(args[-1][1:])
+        args = args[:-1]
+        if target_worker_id >= worker_state['num_workers']:
+            await update.message.reply_text(
+                f"There is no worker w{target_worker_id}, the workers are w0 to w{worker_state['num_workers'] - 1}."
+            )
+            return
+
+    if target_worker_id != own_worker_id:
+        set_shared_state(f"diagnostics_request_{target_worker_id}", {'command': command, 'args': args})
+        await update.message.reply_text(
+            f"Passed {command} on to worker w{target_worker_id}, it will answer within a few seconds."
+        )
+        return
+
+    await run_diagnostics(context.application, command, args)
+
+
+# Job that makes sure the daily reset happens even when nobody writes to the bot
+async def daily_reset_job(context: ContextTypes.DEFAULT_TYPE):
+    if not worker_state['leader']:
+        return
+    check_and_reset_if_needed()
+
+
+def get_update_shard(update, num_workers):
+    """Updates from the same chat always go to the same worker"""
+    if update.effective_chat:
+        key = update.effective_chat.id
+    elif update.effective_user:
+        key = update.effective_user.id
+    else:
+        key = 0
+    return key % num_workers
+
+
+async def fetch_updates(app):
+    """Fetch one batch of updates and hand them to the workers that own their chats"""
+    offset = get_shared_state('update_offset')
+    try:
+        updates = await app.bot.get_updates(
+            offset=offset,
+            timeout=LEADER_POLL_TIMEOUT,
+            allowed_updates=Update.ALL_TYPES
+        )
+    except TelegramError as e:
+        logger.warning(f"Error fetching updates: {e}")
+        await asyncio.sleep(1)
+        return
+
+    if updates:
+        rows = [
+            (u.update_id, get_update_shard(u, worker_state['num_workers']), json.dumps(u.to_dict()))
+            for u in updates
+        ]
+        if not enqueue_updates(worker_state['name'], rows, updates[-1].update_id + 1):
+            # Another worker took over while we were polling, it fetches these again
+            logger.warning(f"Lost the leader lease while polling, dropping {len(updates)} fetched updates")
+            worker_state['leader'] = False
+
+
+async def lead_updates(app):
+    """Compete for the leader lease and, while holding it, poll Telegram for all workers"""
+    loop = asyncio.get_running_loop()
+    while not shutdown_state['stopping']:
+        await run_pending_diagnostics(app)
+
+        is_leader = try_acquire_leadership(worker_state['name'])
+        if is_leader != worker_state['leader']:
+            logger.info(f"Worker {worker_state['name']} {'is now' if is_leader else 'is no longer'} the leader")
+        worker_state['leader'] = is_leader
+
+        if not is_leader:
+            await asyncio.sleep(LEADER_RENEW_INTERVAL)
+            continue
+
+        renew_at = loop.time() + LEADER_RENEW_INTERVAL
+        while loop.time() < renew_at and worker_state['leader'] and not shutdown_state['stopping']:
+            await fetch_updates(app)
+
+
+async def consume_updates(app, shard):
+    """Process the updates routed to this worker, oldest first"""
+    while not shutdown_state['stopping']:
+        queued = get_queued_updates(shard, WORKER_BATCH)
+        if not queued:
+            await asyncio.sleep(WORKER_IDLE_SLEEP)
+            continue
+
+        for update_id, data in queued:
+            # Whatever is left stays in the queue for the next start
+            if shutdown_state['stopping']:
+                break
+            await app.process_update(Update.de_json(data, app.bot))
+            delete_queued_update(update_id)
+
+
+async def run_worker(worker_id, num_workers):
+    worker_state.update({
+        'worker_id': worker_id,
+        'num_workers': num_workers,
+        'name': f"{socket.gethostname()}:{os.getpid()}:worker{worker_id}",
+        'leader': False
+    })
+    logger.info(f"Starting worker {worker_id} of {num_workers} as {worker_state['name']}")
+
+    # Workers don't poll on their own, the leader fetches updates for everyone
+    app = build_application(ApplicationBuilder().token("BotToken").updater(None))
+    async with app:
+        await app.start()
+        await install_shutdown_handlers(app)
+        tasks = [asyncio.create_task(lead_updates(app)), asyncio.create_task(consume_updates(app, worker_id))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # If one loop failed the other would keep taking updates off the queue while the
+            # application stops, and those would be deleted without being handled
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await app.stop()
+            await finish_shutdown(app)
+            release_leadership(worker_state['name'])
+
+
+def request_shutdown(app):
+    """Stop taking new updates and give in-flight work until the deadline to finish"""
+    if shutdown_state['stopping']:
+        return
+    shutdown_state['stopping'] = True
+    shutdown_state['deadline'] = datetime.now() + timedelta(seconds=SHUTDOWN_DRAIN_DEADLINE)
+    logger.info(f"Shutdown requested, draining in-flight sends for up to {SHUTDOWN_DRAIN_DEADLINE}s")
+
+    # Application.stop() waits for every create_task task, so a running /profile would hold
+    # the shutdown for its full length. Cut it short and send what was sampled so far.
+    if profiler_state['task'] is not None:
+        profiler_state['task'].cancel()
+        profiler_state['task'] = app.create_task(stop_profiler(app.bot))
+
+    # Workers run without an updater and watch shutdown_state themselves
+    if app.updater:
+        app.stop_running()
+
+
+def shutdown_deadline_passed(extra_seconds=0):
+    """Check whether work started now (and taking extra_seconds) would overrun the shutdown deadline"""
+    if not shutdown_state['stopping']:
+        return False
+    return datetime.now() + timedelta(seconds=extra_seconds) >= shutdown_state['deadline']
+
+
+async def install_shutdown_handlers(app):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, request_shutdown, app)
+        except NotImplementedError:
+            # Windows: fall back to the default KeyboardInterrupt handling
+            logger.warning("Signal handlers are not supported here, in-flight sends won't be drained on shutdown")
+            return
+
+
+async def finish_shutdown(app):
+    """Flush the database and report what is left for the next start"""
+    checkpoint_database()
+
+    counts = get_pending_work_counts()
+    summary = (
+        f"Bot stopped. Left pending: {counts['pending_forwards']} queued forwards, "
+        f"{counts['broadcast_outbox']} broadcast deliveries, "
+        f"{counts['update_queue']} unprocessed updates."
+    )
+    logger.info(summary)
+
+    # Only one worker tells the admins
+    if worker_state['leader'] and any(counts.values()):
+        try:
+            await app.bot.send_message(chat_id=ADMIN_CHAT_ID, text=summary)
+        except TelegramError as e:
+            logger.error(f"Error sending shutdown report: {e}")
+
+
+def run_worker_process(worker_id, num_workers):
+    # Don't inherit the launcher's handlers, they act on the launcher's process list
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    try:
+        asyncio.run(run_worker(worker_id, num_workers))
+    except KeyboardInterrupt:
+        pass
+
+
+def start_worker_process(worker_id, num_workers):
+    process = multiprocessing.Process(
+        target=run_worker_process,
+        args=(worker_id, num_workers),
+        name=f"worker-{worker_id}"
+    )
+    process.start()
+    return process
+
+
+def supervise_workers(num_workers):
+    """Start the workers and restart any that exit, so every shard always has a worker"""
+    processes = {worker_id: start_worker_process(worker_id, num_workers) for worker_id in range(num_workers)}
+    stopping = threading.Event()
+
+    def stop_workers(signum, frame):
+        # Pass the signal on as SIGTERM so each worker shuts down gracefully
+        stopping.set()
+        for process in processes.values():
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+
+    while not stopping.is_set():
+        multiprocessing.connection.wait([process.sentinel for process in processes.values()], timeout=1)
+        for worker_id, process in list(processes.items()):
+            if process.exitcode is None or stopping.is_set():
+                continue
+            logger.error(f"Worker {worker_id} exited with code {process.exitcode}, restarting it in {WORKER_RESTART_DELAY}s")
+            # Wait a little so a worker that crashes on start doesn't spin
+            if stopping.wait(WORKER_RESTART_DELAY):
+                break
+            processes[worker_id] = start_worker_process(worker_id, num_workers)
+
+    for process in processes.values():
+        process.join()
+
+
+def build_application(builder):
+    app = builder.build()
 
     # Add handlers
     app.add_handler(CommandHandler("start", start))
@@ -756,6 +1936,13 @@ def main():
         filters.Chat(chat_id=-4796230051)
     ))
 
+    # Profiling and memory diagnostics, admin chat only
+    app.add_handler(CommandHandler(
+        ["profile", "memdiff", "loopstats"],
+        handle_diagnostics_command,
+        filters.Chat(chat_id=-4796230051)
+    ))
+
     # Handle admin replies
     app.add_handler(MessageHandler(
         filters.Chat(chat_id=-4796230051) & filters.REPLY,
@@ -764,7 +1951,7 @@ def main():
 
     # Handle pending broadcast messages - ONLY when we're expecting them
     app.add_handler(MessageHandler(
-        filters.Chat(chat_id=-4796230051) & ~filters.COMMAND & ~filters.REPLY,
+        filters.Chat(chat_id=-4796230051) & ~filters.COMMAND & ~filters.REPLY & ~filters.StatusUpdate.ALL,
         handle_admin_command
     ), group=2)
 
@@ -774,8 +1961,54 @@ def main():
         handle_message
     ), group=3)
 
-    # Start the bot
-    app.run_polling()
+    # Background jobs. They run in every worker but only do work on the leader.
+    if app.job_queue:
+        # Retry forwards that couldn't reach the admin chat
+        app.job_queue.run_repeating(flush_pending_forwards, interval=PENDING_FLUSH_INTERVAL, first=PENDING_FLUSH_INTERVAL)
+        app.job_queue.run_repeating(daily_reset_job, interval=RESET_CHECK_INTERVAL, first=0)
+        app.job_queue.run_repeating(drain_broadcast_outbox, interval=BROADCAST_OUTBOX_INTERVAL, first=10)
+    else:
+        logger.warning("JobQueue is not available, queued forwards are only retried when the next message "
+                       "comes in. Install python-telegram-bot[job-queue] to retry them in the background.")
+
+    return app
+
+
+# Main function to run the bot
+def main():
+    parser = argparse.ArgumentParser(description="Room selection bot")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes, updates are sharded between them by chat id")
+    parser.add_argument('--worker-id', type=int,
+                        help="run only this worker (0-based) instead of starting all of them")
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.worker_id is not None and not 0 <= args.worker_id < args.workers:
+        parser.error("--worker-id must be between 0 and --workers - 1")
+
+    # Only the leader's jobs drain the shared queues, workers can't catch up inline safely
+    if args.workers > 1 and importlib.util.find_spec('apscheduler') is None:
+        parser.error("--workers needs python-telegram-bot[job-queue]")
+
+    if args.worker_id is not None:
+        run_worker_process(args.worker_id, args.workers)
+        return
+
+    if args.workers == 1:
+        # Create and run the bot
+        app = build_application(
+            ApplicationBuilder()
+            .token("BotToken")
+            .post_init(install_shutdown_handlers)
+            .post_stop(finish_shutdown)
+        )
+        # Our own signal handlers drain in-flight sends before stopping
+        app.run_polling(stop_signals=None)
+        return
+
+    supervise_workers(args.workers)
 
 
 if __name__ == '__main__':
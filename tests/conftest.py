@@ -0,0 +1,18 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def bot(tmp_path_factory):
+    """main.py imported against a throwaway database instead of the real user_rooms.db"""
+    old_cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('db'))
+    try:
+        yield importlib.import_module('main')
+    finally:
+        os.chdir(old_cwd)
@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import pytest
+from telegram import Chat, Message, MessageEntity, PhotoSize
+
+from test_forward_header import TEXTS, read_telegram_html
+
+URLS = [
+    'https://example.com/',
+    'https://ex.com/?q="x"',
+    'https://example.com/?a=1&b=2',
+    "https://example.com/it's<here>",
+]
+
+
+def link_entities(text, url):
+    """A bold word and a link over the whole text, nested the way the Telegram apps send them"""
+    length = len(text.encode('utf-16-le')) // 2
+    return [
+        MessageEntity(MessageEntity.TEXT_LINK, 0, length, url=url),
+        MessageEntity(MessageEntity.BOLD, 0, min(length, 3)),
+    ]
+
+
+@pytest.mark.parametrize('url', URLS)
+@pytest.mark.parametrize('text', TEXTS)
+def test_broadcast_text_keeps_links(bot, text, url):
+    message = Message(1, datetime.now(), Chat(-1, Chat.GROUP), text=text, entities=link_entities(text, url))
+
+    item = bot.build_broadcast_item(message)
+
+    assert item['type'] == 'text'
+    assert read_telegram_html(item['content'], links=[url]) == text
+
+
+@pytest.mark.parametrize('url', URLS)
+@pytest.mark.parametrize('media_group_id', [None, 'album'])
+def test_broadcast_caption_keeps_links(bot, url, media_group_id):
+    caption = 'see <this> & that'
+    message = Message(
+        1, datetime.now(), Chat(-1, Chat.GROUP),
+        photo=[PhotoSize('file', 'unique', 10, 10)],
+        caption=caption,
+        caption_entities=link_entities(caption, url),
+        media_group_id=media_group_id
+    )
+
+    item = bot.build_broadcast_item(message)
+
+    part = item['media'][0] if media_group_id else item
+    assert part['type'] == 'photo'
+    assert read_telegram_html(part['caption'], links=[url]) == caption
+
+
+def test_broadcast_without_caption(bot):
+    message = Message(1, datetime.now(), Chat(-1, Chat.GROUP), photo=[PhotoSize('file', 'unique', 10, 10)])
+
+    assert bot.build_broadcast_item(message)['caption'] is None
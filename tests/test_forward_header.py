@@ -0,0 +1,156 @@
+import asyncio
+import re
+from datetime import datetime
+from html.parser import HTMLParser
+
+import pytest
+from telegram import Chat, Message, MessageEntity
+from telegram.constants import ParseMode
+
+# Tags Telegram accepts with ParseMode.HTML
+TELEGRAM_TAGS = {'b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del', 'span', 'tg-spoiler',
+                 'a', 'tg-emoji', 'code', 'pre', 'blockquote'}
+
+USERNAMES = [
+    'plain',
+    'user_123456',          # the default fallback name
+    'a_b_c',
+    '__init__',
+    '*star*',
+    '`tick`',
+    '[link](http://example.com)',
+    '<b>bold</b>',
+    'a < b > c',
+    'tom&jerry',
+    '&amp;',
+    '&#60;',
+    '"quoted" \'single\'',
+    'smile 😀_*',
+    'שלום_עולם',             # RTL
+    'مرحبا *بالعالم*',
+    '‮evil',           # right-to-left override
+    '\\_escaped\\*',
+]
+
+TEXTS = [
+    'hello',
+    '*unclosed bold',
+    '_unclosed italic',
+    'snake_case_name and 2*3*4',
+    'a < b && c > d',
+    '<i>not html</i>',
+    '[x](http://example.com)',
+    '```code',
+    '&lt; already escaped &amp;',
+    'emoji 😀 and 👨‍👩‍👧 family',
+    'שלום *עולם*',
+    'line one\nline two',
+]
+
+
+def entity_variants(text):
+    """No entities, one entity over the whole text, and a link whose URL needs escaping"""
+    length = len(text.encode('utf-16-le')) // 2
+    return [
+        [],
+        [MessageEntity(MessageEntity.BOLD, 0, length)],
+        [MessageEntity(MessageEntity.TEXT_LINK, 0, length, url='https://example.com/?a=1&b="2"')],
+    ]
+
+
+class TelegramHTMLReader(HTMLParser):
+    """Reads text back the way Telegram does, failing on anything Telegram would reject"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.open_tags = []
+        self.text = ''
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        assert tag in TELEGRAM_TAGS, f"unsupported tag <{tag}>"
+        self.open_tags.append(tag)
+        if tag == 'a':
+            self.links.append(dict(attrs).get('href'))
+
+    def handle_endtag(self, tag):
+        assert self.open_tags and self.open_tags.pop() == tag, f"unbalanced </{tag}>"
+
+    def handle_data(self, data):
+        self.text += data
+
+
+def read_telegram_html(html_text, links=None):
+    """Return the plain text Telegram would show for html_text, asserting that it parses.
+
+    If links is given, the hrefs of the <a> tags have to read back as exactly those URLs.
+    """
+    # Telegram only knows these named entities, everything else has to be numeric
+    for entity in re.findall(r'&[^;\s]*;?', html_text):
+        assert re.fullmatch(r'&(lt|gt|amp|quot|#\d+|#x[0-9a-fA-F]+);', entity), f"bad entity {entity!r}"
+    # Every < has to start a supported tag
+    for match in re.finditer('<', html_text):
+        tag = re.match(r'</?([a-z-]+)[\s>]', html_text[match.start():])
+        assert tag and tag.group(1) in TELEGRAM_TAGS, f"stray < in {html_text!r}"
+
+    reader = TelegramHTMLReader()
+    reader.feed(html_text)
+    reader.close()
+    assert not reader.open_tags, f"unclosed {reader.open_tags}"
+    if links is not None:
+        assert reader.links == links, f"links read back as {reader.links}"
+    return reader.text
+
+
+def make_message(text, entities=()):
+    return Message(1, datetime.now(), Chat(42, Chat.PRIVATE), text=text, entities=list(entities))
+
+
+@pytest.mark.parametrize('username', USERNAMES)
+@pytest.mark.parametrize('room', ['room1', 'room_2', '<room>'])
+def test_header_is_valid_html(bot, username, room):
+    header = bot.render_forward_header(42, username, room)
+
+    assert read_telegram_html(header) == f"Message from {username} | Room: {room}\n\n"
+
+
+def test_header_falls_back_to_user_id(bot):
+    header = bot.render_forward_header(42, None, None)
+
+    assert read_telegram_html(header) == "Message from user_42 | Room: Unknown Room\n\n"
+
+
+@pytest.mark.parametrize('username', USERNAMES)
+@pytest.mark.parametrize('text', TEXTS)
+def test_forwarded_text_is_valid_html(bot, username, text):
+    header = bot.render_forward_header(42, username, 'room1')
+
+    for entities in entity_variants(text):
+        forward = bot.build_forward(make_message(text, entities), header, 42, 42)
+
+        assert forward['parse_mode'] == ParseMode.HTML
+        assert read_telegram_html(f"{forward['header']}{forward['content']}") == \
+            f"Message from {username} | Room: room1\n\n{text}"
+
+
+@pytest.mark.parametrize('username', USERNAMES)
+def test_header_is_cached_with_user_state(bot, username):
+    bot.update_user_room(7, 'room3', username)
+
+    assert bot.get_user_info(7)['header'] == bot.render_forward_header(7, username, 'room3')
+
+
+def test_deliver_forward_sends_html(bot):
+    sent = []
+
+    class FakeBot:
+        async def send_message(self, **kwargs):
+            sent.append(kwargs)
+            return make_message('sent')
+
+    header = bot.render_forward_header(42, 'user_42', 'room1')
+    forward = bot.build_forward(make_message('*not bold*'), header, 42, 42)
+    asyncio.run(bot.deliver_forward(FakeBot(), forward))
+
+    assert sent[0]['parse_mode'] == ParseMode.HTML
+    assert read_telegram_html(sent[0]['text']) == "Message from user_42 | Room: room1\n\n*not bold*"